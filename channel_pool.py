@@ -0,0 +1,48 @@
+"""
+Channel gRPC dùng chung cho server (kết nối tới peer) và client:
+- RECONNECT_BACKOFF_OPTIONS: giới hạn backoff reconnect
+- ChannelPool: nhiều channel tới cùng 1 node
+"""
+
+import itertools
+
+import grpc
+
+import raft_pb2_grpc
+
+# Channel sống suốt vòng đời process nên sẽ gặp node bị restart.
+# Backoff reconnect mặc định của gRPC tăng tới 120s → node vừa chạy lại vẫn
+# bị coi là UNAVAILABLE rất lâu (peer không nhận được heartbeat kịp và tự
+# bầu cử, client nhận lỗi tức thì). Giới hạn ở 1s để kết nối lại ngay.
+RECONNECT_BACKOFF_OPTIONS = [
+    ("grpc.initial_reconnect_backoff_ms", 200),
+    ("grpc.min_reconnect_backoff_ms", 200),
+    ("grpc.max_reconnect_backoff_ms", 1000),
+]
+
+
+class ChannelPool:
+    """
+    Nhiều channel tới cùng 1 node, chọn stub theo round-robin.
+    Mỗi channel có channel args khác nhau (grpc.channel_number) để gRPC
+    mở kết nối TCP riêng → RPC đồng thời không bị head-of-line blocking
+    / flow control của 1 kết nối HTTP/2 duy nhất.
+    """
+
+    def __init__(self, addr, options, size):
+        self.channels = [
+            grpc.insecure_channel(
+                addr, options=options + [("grpc.channel_number", i)]
+            )
+            for i in range(size)
+        ]
+        self.stubs = [raft_pb2_grpc.RaftStub(c) for c in self.channels]
+        self.counter = itertools.count()
+
+    def next_stub(self):
+        # next() trên itertools.count là atomic dưới GIL
+        return self.stubs[next(self.counter) % len(self.stubs)]
+
+    def close(self):
+        for channel in self.channels:
+            channel.close()
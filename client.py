@@ -1,8 +1,18 @@
+import atexit
+import queue
+import shlex
+import time
 import grpc
 import raft_pb2
 import raft_pb2_grpc
+from channel_pool import ChannelPool, RECONNECT_BACKOFF_OPTIONS
 import argparse
 
+try:
+    import readline  # noqa: F401  (lịch sử lệnh + chỉnh sửa dòng cho input())
+except ImportError:  # Windows không có readline
+    pass
+
 parser = argparse.ArgumentParser()
 parser.add_argument(
     "--nodes",
@@ -14,15 +24,107 @@ args = parser.parse_args()
 
 ADDRESSES = args.nodes
 
-# ===== Hàm tiện ích: tạo stub để gọi RPC =====
+# port -> địa chỉ đầy đủ, tính 1 lần từ --nodes (dùng cho lệnh partition)
+_ADDR_BY_PORT = {a.rsplit(":", 1)[1]: a for a in ADDRESSES}
+
+def port_to_addr(port):
+    addr = _ADDR_BY_PORT.get(port)
+    if addr is None:  # port không có trong --nodes
+        addr = f"localhost:{port}"
+    return addr
+
+# Message không đổi → tạo 1 lần, dùng lại cho mọi lần gọi (chỉ đọc)
+_EMPTY = raft_pb2.Empty()
+_CLEAR_PARTITION_REQ = raft_pb2.PartitionRequest(blocked_addresses=[])
+
+# ===== Channel/stub cache =====
+# Mỗi địa chỉ chỉ tạo 1 channel dùng suốt phiên làm việc, tránh phải
+# bắt tay TCP + HTTP/2 lại cho mỗi RPC. Keepalive giữ kết nối khi CLI rảnh.
+_CHANNEL_OPTIONS = [
+    ("grpc.keepalive_time_ms", 30000),
+    ("grpc.keepalive_timeout_ms", 10000),
+    ("grpc.keepalive_permit_without_calls", 1),
+    ("grpc.http2.max_pings_without_data", 0),
+    ("grpc.http2.min_time_between_pings_ms", 10000),
+] + RECONNECT_BACKOFF_OPTIONS
+
+_CHANNELS = {}  # addr -> grpc.Channel
+_STUBS = {}     # addr -> raft_pb2_grpc.RaftStub
+
+# ===== Hàm tiện ích: lấy stub (đã cache) để gọi RPC =====
 def get_stub(addr):
-    channel = grpc.insecure_channel(addr)
-    return raft_pb2_grpc.RaftStub(channel)
+    stub = _STUBS.get(addr)
+    if stub is None:
+        channel = grpc.insecure_channel(addr, options=_CHANNEL_OPTIONS)
+        _CHANNELS[addr] = channel
+        stub = _STUBS[addr] = raft_pb2_grpc.RaftStub(channel)
+    return stub
+
+# ===== Channel pool cho đường set/get =====
+POOL_SIZE = 4
+
+_POOLS = {}  # addr -> ChannelPool
+
+def get_pool(addr):
+    pool = _POOLS.get(addr)
+    if pool is None:
+        pool = _POOLS[addr] = ChannelPool(addr, _CHANNEL_OPTIONS, POOL_SIZE)
+        # Mỗi channel trong pool là 1 kết nối riêng → mở trước tất cả ở nền,
+        # không để POOL_SIZE lệnh set/get đầu tiên lần lượt trả chi phí bắt tay
+        _READY_FUTURES.extend(
+            grpc.channel_ready_future(channel) for channel in pool.channels
+        )
+    return pool
+
+# ===== Mở trước kết nối tới mọi node =====
+# channel_ready_future bắt đầu kết nối ở nền (không chờ), để lệnh đầu tiên
+# không phải trả chi phí bắt tay TCP + HTTP/2. Pool của leader được mở
+# trước ngay khi tìm thấy leader (get_pool trong find_leader)
+_READY_FUTURES = []
+
+def warm_up_channels():
+    for addr in ADDRESSES:
+        get_stub(addr)
+        _READY_FUTURES.append(grpc.channel_ready_future(_CHANNELS[addr]))
+
+def _close_channels():
+    for future in _READY_FUTURES:
+        future.cancel()
+    _READY_FUTURES.clear()
+    for channel in _CHANNELS.values():
+        channel.close()
+    for pool in _POOLS.values():
+        pool.close()
+    _CHANNELS.clear()
+    _STUBS.clear()
+    _POOLS.clear()
+
+atexit.register(_close_channels)
+
+# ===== Cache leader =====
+# Leader ít khi đổi → dùng lại địa chỉ đã tìm được cho các lệnh sau,
+# chỉ tìm lại khi leader cũ báo lỗi / từ chối
+_LEADER_CACHE = None
+
+_STALE_LEADER_CODES = (
+    grpc.StatusCode.UNAVAILABLE,
+    grpc.StatusCode.FAILED_PRECONDITION,
+    grpc.StatusCode.DEADLINE_EXCEEDED,
+)
+
+# Tổng thời gian tối đa cho 1 lệnh set/get (tìm leader + RPC)
+REQUEST_TIMEOUT = 10.0
+
+# ===== Circuit breaker cho node lỗi =====
+# Node vừa lỗi sẽ bị bỏ qua khi tìm leader trong COOLDOWN_SECS giây
+COOLDOWN_SECS = 5.0
+_COOLDOWN = {}  # addr -> thời điểm (monotonic) được thử lại
 
 # ===== Hàm tìm leader =====
-# Client thử gọi ClientGet với key "__ping__"
-# Node nào trả lời thành công → leader
-def find_leader():
+# Client gọi GetLeader trên mọi node
+# Node nào trả lời is_leader → leader
+def find_leader(timeout=1.0):
+    global _LEADER_CACHE
     # First, try GetLeader RPC which explicitly returns whether the node is leader
     node_map = {
         "node1": "localhost:5001",
@@ -32,51 +134,132 @@ def find_leader():
         "node5": "localhost:5005",
     }
 
+    # Gửi GetLeader tới tất cả node cùng lúc, xử lý theo thứ tự trả lời về
+    done = queue.Queue()
+    pending = {}
+    now = time.monotonic()
     for addr in ADDRESSES:
-        try:
-            stub = get_stub(addr)
-            resp = stub.GetLeader(raft_pb2.Empty(), timeout=1)
+        if _COOLDOWN.get(addr, 0) > now:
+            continue
+        future = get_stub(addr).GetLeader.future(_EMPTY, timeout=timeout)
+        pending[future] = addr
+        future.add_done_callback(done.put)
+
+    reported = None  # (leader_addr, reporter) do follower báo về
+    try:
+        for _ in range(len(pending)):
+            future = done.get()
+            addr = pending[future]
+            try:
+                resp = future.result()
+            except grpc.RpcError:
+                _COOLDOWN[addr] = time.monotonic() + COOLDOWN_SECS
+                continue
+            _COOLDOWN.pop(addr, None)
             if resp.is_leader:
                 print(f"[CLIENT] Leader found at {addr}")
+                _LEADER_CACHE = addr
+                get_pool(addr)
                 return addr
-            # If the node knows who the leader is, resolve and return that address
-            if resp.leader_id:
+            # If the node knows who the leader is, remember that address
+            if resp.leader_id and reported is None:
                 leader_addr = node_map.get(resp.leader_id)
-                if leader_addr:
-                    print(f"[CLIENT] Leader found at {leader_addr} || Reported by {addr} ")
-                    return leader_addr
-        except Exception:
-            continue
+                # Node chưa biết leader sẽ trả về chính ID của nó → bỏ qua
+                if leader_addr and leader_addr != addr:
+                    reported = (leader_addr, addr)
+    finally:
+        # Leader đã tìm thấy → hủy các RPC còn đang chờ
+        for future in pending:
+            future.cancel()
+
+    if reported:
+        leader_addr, addr = reported
+        print(f"[CLIENT] Leader found at {leader_addr} || Reported by {addr} ")
+        _LEADER_CACHE = leader_addr
+        get_pool(leader_addr)
+        return leader_addr
 
     print("[CLIENT] No leader found")
+    _LEADER_CACHE = None
+    _COOLDOWN.clear()  # lần tìm sau thử lại tất cả node
     return None
 
-# ===== Hàm gửi lệnh set (ghi key=value) =====
-def set_value(key, value):
-    leader = find_leader()
-    if not leader:
-        return
+# ===== Tìm leader, chờ qua giai đoạn bầu cử =====
+# Khi cluster mới khởi động hoặc đang bầu leader, thử lại với
+# exponential backoff (0.1s → tối đa 2s) cho tới khi hết max_wait
+def find_leader_with_retry(max_wait=20.0):
+    delay = 0.1
+    deadline = time.monotonic() + max_wait
+    while True:
+        leader = find_leader(
+            timeout=max(0.2, min(1.0, deadline - time.monotonic()))
+        )
+        if leader:
+            return leader
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 2.0)
 
-    stub = get_stub(leader)
-    resp = stub.ClientSet(
-        raft_pb2.ClientSetRequest(
-            key=key,
-            value=str(value)   # gRPC proto khai báo value là string → ép kiểu
+# ===== Gọi RPC trên leader (có cache) =====
+# rpc(stub, timeout) thực hiện lời gọi; ok(resp) = False nghĩa là node không còn là leader.
+# Khi leader cũ lỗi/từ chối → xóa cache, tìm leader lại và thử thêm 1 lần.
+# Tìm leader và RPC dùng chung 1 deadline total_timeout.
+def call_leader(rpc, ok=lambda resp: True, total_timeout=REQUEST_TIMEOUT):
+    global _LEADER_CACHE
+    deadline = time.monotonic() + total_timeout
+    resp = None
+    for _ in range(2):
+        leader = _LEADER_CACHE or find_leader_with_retry(
+            max_wait=deadline - time.monotonic()
         )
+        if not leader:
+            return None
+        try:
+            resp = rpc(
+                get_pool(leader).next_stub(),
+                max(0.2, deadline - time.monotonic()),
+            )
+        except grpc.RpcError as e:
+            if e.code() not in _STALE_LEADER_CODES:
+                raise
+            print(f"[CLIENT] {leader} rejected request: {e.code().name}")
+            resp = None
+        if resp is not None and ok(resp):
+            return resp
+        _LEADER_CACHE = None
+    return resp
+
+# ===== Hàm gửi lệnh set (ghi key=value) =====
+def set_value(key, value, total_timeout=REQUEST_TIMEOUT):
+    resp = call_leader(
+        lambda stub, timeout: stub.ClientSet(
+            raft_pb2.ClientSetRequest(
+                key=key,
+                value=str(value)   # gRPC proto khai báo value là string → ép kiểu
+            ),
+            timeout=timeout,
+        ),
+        ok=lambda resp: resp.success,
+        total_timeout=total_timeout,
     )
+    if resp is None:
+        return
 
     print(f"[CLIENT] SET {key}={value} success={resp.success}")
 
 # ===== Hàm gửi lệnh get (lấy giá trị key) =====
-def get_value(key):
-    leader = find_leader()
-    if not leader:
-        return
-
-    stub = get_stub(leader)
-    resp = stub.ClientGet(
-        raft_pb2.ClientGetRequest(key=key)
+def get_value(key, total_timeout=REQUEST_TIMEOUT):
+    resp = call_leader(
+        lambda stub, timeout: stub.ClientGet(
+            raft_pb2.ClientGetRequest(key=key),
+            timeout=timeout,
+        ),
+        total_timeout=total_timeout,
     )
+    if resp is None:
+        return
 
     if resp.found:
         print(f"[CLIENT] GET {key}={resp.value}")
@@ -86,13 +269,15 @@ def get_value(key):
 # ===== Hàm thiết lập partition (block peer) =====
 def set_partition(target_addr, blocked_list):
     stub = get_stub(target_addr)
+    if blocked_list:
+        request = raft_pb2.PartitionRequest(blocked_addresses=blocked_list)
+    else:
+        request = _CLEAR_PARTITION_REQ  # clear_partition
     try:
-        resp = stub.SetPartition(
-            raft_pb2.PartitionRequest(blocked_addresses=blocked_list)
-        )
+        resp = stub.SetPartition(request)
         print(f"[CLIENT] Partition set on {target_addr}. Blocked: {blocked_list}")
-    except Exception as e:
-        print(f"[CLIENT] Error setting partition on {target_addr}: {e}")
+    except grpc.RpcError as e:
+        print(f"[CLIENT] Error setting partition on {target_addr}: {e.code().name}")
 
 # ===== In hướng dẫn sử dụng CLI =====
 def print_help():
@@ -109,17 +294,70 @@ Commands:
   exit               # Thoát client
 """)
 
+# ===== Xử lý từng lệnh CLI =====
+def _do_getleader(cmd):
+    find_leader()  # tìm leader và in ra
+
+def _do_set(cmd):
+    if len(cmd) != 3:
+        print("Usage: set <key> <value>")
+        return
+    set_value(cmd[1], cmd[2])  # gửi lệnh set
+
+def _do_get(cmd):
+    if len(cmd) != 2:
+        print("Usage: get <key>")
+        return
+    get_value(cmd[1])  # gửi lệnh get
+
+def _do_partition(cmd):
+    if len(cmd) < 3:
+        print("Usage: partition <target_port> <blocked_port1> [blocked_port2 ...]")
+        return
+
+    target_port = cmd[1]
+    blocked_ports = cmd[2:]
+
+    # Convert ports to full addresses
+    target_addr = port_to_addr(target_port)
+    blocked_addrs = [port_to_addr(p) for p in blocked_ports]
+
+    set_partition(target_addr, blocked_addrs)
+
+def _do_clear_partition(cmd):
+    if len(cmd) != 2:
+        print("Usage: clear_partition <target_port>")
+        return
+
+    target_port = cmd[1]
+    target_addr = port_to_addr(target_port)
+    set_partition(target_addr, [])
+
+# Bảng lệnh → hàm xử lý ("exit" được xử lý riêng trong vòng lặp)
+HANDLERS = {
+    "getleader": _do_getleader,
+    "set": _do_set,
+    "get": _do_get,
+    "partition": _do_partition,
+    "clear_partition": _do_clear_partition,
+}
+
 # ===== Main CLI =====
 if __name__ == "__main__":
     print("RAFT Client CLI")
     print_help()
+    warm_up_channels()
 
     # Vòng lặp đọc lệnh từ người dùng
     while True:
         try:
-            cmd = input("> ").strip().split()  # đọc lệnh và tách thành danh sách
+            # đọc lệnh và tách thành danh sách (hỗ trợ "giá trị có dấu cách")
+            cmd = shlex.split(input("> "))
         except KeyboardInterrupt:
             break  # Ctrl+C thoát
+        except ValueError as e:
+            print(f"Invalid command: {e}")  # VD: thiếu dấu nháy đóng
+            continue
 
         if not cmd:
             continue
@@ -127,44 +365,9 @@ if __name__ == "__main__":
         if cmd[0] == "exit":
             break
 
-        elif cmd[0] == "getleader":
-            find_leader()  # tìm leader và in ra
-
-        elif cmd[0] == "set":
-            if len(cmd) != 3:
-                print("Usage: set <key> <value>")
-                continue
-            set_value(cmd[1], cmd[2])  # gửi lệnh set
-
-        elif cmd[0] == "get":
-            if len(cmd) != 2:
-                print("Usage: get <key>")
-                continue
-            get_value(cmd[1])  # gửi lệnh get
-
-        elif cmd[0] == "partition":
-            if len(cmd) < 3:
-                print("Usage: partition <target_port> <blocked_port1> [blocked_port2 ...]")
-                continue
-            
-            target_port = cmd[1]
-            blocked_ports = cmd[2:]
-            
-            # Convert ports to full addresses
-            target_addr = f"localhost:{target_port}"
-            blocked_addrs = [f"localhost:{p}" for p in blocked_ports]
-            
-            set_partition(target_addr, blocked_addrs)
-
-        elif cmd[0] == "clear_partition":
-            if len(cmd) != 2:
-                print("Usage: clear_partition <target_port>")
-                continue
-            
-            target_port = cmd[1]
-            target_addr = f"localhost:{target_port}"
-            set_partition(target_addr, [])
-
-        else:
+        handler = HANDLERS.get(cmd[0])
+        if handler is None:
             print("Unknown command")
             print_help()  # in hướng dẫn nếu lệnh không hợp lệ
+            continue
+        handler(cmd)
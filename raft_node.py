@@ -1,25 +1,84 @@
 import time
 import threading
 import random
+import logging
+import queue
+import statistics
+from collections import deque
 import grpc
 
 import raft_pb2
 import raft_pb2_grpc
+from channel_pool import ChannelPool, RECONNECT_BACKOFF_OPTIONS
+
+
+# Log qua logging (lazy %-format); server.py gắn QueueHandler để ghi ra
+# stdout ở thread riêng, RPC handler không phải chờ I/O
+logger = logging.getLogger("raft")
 
 
 FOLLOWER = "FOLLOWER"
 CANDIDATE = "CANDIDATE"
 LEADER = "LEADER"
 
+# Chu kỳ heartbeat của leader
+HEARTBEAT_INTERVAL = 1.0
+
+# Election timeout thích nghi: e_t = μ + 3σ của khoảng cách giữa các
+# heartbeat gần đây, kẹp trong [MIN, MAX]; timeout ngẫu nhiên trong [e_t, 2·e_t].
+# Chưa đủ mẫu (mới khởi động / vừa đổi leader) → e_t = MAX, tức 5-10s như cũ
+ELECTION_TIMEOUT_MIN = 2 * HEARTBEAT_INTERVAL
+ELECTION_TIMEOUT_MAX = 5.0
+HB_SAMPLES = 64
+MIN_HB_SAMPLES = 5
+
+# Gom ClientSet: replicate ngay khi có BATCH_MAX_ENTRIES entry mới,
+# hoặc sau BATCH_WINDOW giây kể từ entry mới đầu tiên
+BATCH_MAX_ENTRIES = 64
+BATCH_WINDOW = 0.005
+
+# Số entry tối đa trong 1 AppendEntries (follower tụt xa nhận dần qua nhiều lượt)
+MAX_APPEND_ENTRIES = 1024
+
+# Thời gian tối đa cho 1 vòng RPC tới tất cả peer (bầu cử / heartbeat).
+# RPC gửi song song nên 1 peer chậm không làm các peer còn lại phải chờ
+RPC_ROUND_TIMEOUT = 1.0
+
+# Channel tới peer dùng suốt vòng đời node
+PEER_CHANNEL_OPTIONS = [
+    ("grpc.keepalive_time_ms", 10000),
+    ("grpc.max_concurrent_streams", 1000),
+] + RECONNECT_BACKOFF_OPTIONS
+PEER_POOL_SIZE = 4
+
+# Peer không kết nối được (UNAVAILABLE) → bỏ qua các lượt gửi dồn dập
+# (batch ClientSet) tới peer đó, lùi BASE·2^(n-1) giây, tối đa
+# PEER_BACKOFF_MAX. MAX < 1 HEARTBEAT_INTERVAL nên peer vẫn được thử gửi
+# ít nhất mỗi HEARTBEAT_INTERVAL + PEER_BACKOFF_MAX giây, thấp hơn hẳn
+# ELECTION_TIMEOUT_MIN → follower chỉ lỗi kết nối thoáng qua không tự bầu cử
+PEER_BACKOFF_BASE = 0.1
+PEER_BACKOFF_MAX = HEARTBEAT_INTERVAL / 2
+
 
 class RaftNode(raft_pb2_grpc.RaftServicer):
-    def __init__(self, node_id, peers):
+    def __init__(self, node_id, peers,
+                 batch_max=BATCH_MAX_ENTRIES, batch_window=BATCH_WINDOW):
         """
-        node_id : ID của node (node1, node2, ...)
-        peers   : dict {peer_id: "host:port"}
+        node_id      : ID của node (node1, node2, ...)
+        peers        : dict {peer_id: "host:port"}
+        batch_max    : số entry mới tối đa gom lại trước khi replicate
+        batch_window : thời gian (giây) chờ gom thêm entry mới
         """
         self.node_id = node_id
         self.peers = peers
+        # Số phiếu / bản sao phải vượt quá giá trị này (tính cả chính node)
+        self.majority = (len(peers) + 1) // 2
+
+        # ===== gRPC channel pool tới từng peer (tạo 1 lần, dùng lại) =====
+        self.pools = {
+            peer_id: ChannelPool(addr, PEER_CHANNEL_OPTIONS, PEER_POOL_SIZE)
+            for peer_id, addr in peers.items()
+        }
 
         # ===== Persistent state (RAFT) =====
         self.current_term = 0
@@ -33,6 +92,8 @@ class RaftNode(raft_pb2_grpc.RaftServicer):
         # ===== Leader-only volatile state =====
         self.next_index = {}    # peer_id -> next log index
         self.match_index = {}   # peer_id -> highest replicated index
+        self._peer_fails = {}       # peer_id -> số lần UNAVAILABLE liên tiếp
+        self._peer_fail_until = {}  # peer_id -> monotonic time được gửi lại
 
         # ===== Node state =====
         self.state = FOLLOWER
@@ -42,26 +103,58 @@ class RaftNode(raft_pb2_grpc.RaftServicer):
         self.kv_store = {}
 
         # ===== Heartbeat & election =====
-        self.last_heartbeat = time.time()
+        self.last_heartbeat = time.monotonic()
         self.heartbeat_count = 0
+        # Được set mỗi khi nhận heartbeat hợp lệ / cấp phiếu → reset election timer
+        self.hb_event = threading.Event()
+        # Khoảng cách (giây) giữa các heartbeat gần đây từ leader hiện tại
+        self.hb_intervals = deque(maxlen=HB_SAMPLES)
 
         self.lock = threading.Lock()
-
-        self.start_time = time.time() 
+        # Báo cho applier thread khi commit_index tăng
+        self.apply_cv = threading.Condition(self.lock)
+
+        # ===== Gom ClientSet để replicate theo lô =====
+        self.batch_max = batch_max
+        self.batch_window = batch_window
+        self.pending_entries = 0  # số entry mới chưa gửi đi
+        self.pending_cv = threading.Condition(self.lock)
+        # Request lặp lại y hệt giữa các lượt (heartbeat rỗng, hoặc gửi lại
+        # cho follower chậm chưa trả lời) → giữ lại theo next_index:
+        # next_idx -> (key, request, số entry), chỉ giữ các next_idx còn dùng
+        self._req_cache = {}
+
+        self.start_time = time.monotonic()
         
         # ===== Fault Simulation =====
-        self.blocked_peers = set() # Set of "host:port" to block
+        self.blocked_peers = frozenset() # Set of "host:port" to block
+        # (peer_id, addr) không bị block, dựng lại mỗi lần SetPartition
+        self._peer_list = tuple(peers.items())
+        self._active_peers = self._peer_list
 
         # Start election timeout thread
         threading.Thread(target=self.election_loop, daemon=True).start()
+        # Start applier thread (apply log đã commit vào kv_store)
+        threading.Thread(target=self.apply_loop, daemon=True).start()
+
+    def close(self):
+        """
+        Đóng các channel tới peer
+        """
+        for pool in self.pools.values():
+            pool.close()
 
     # =====================================================
     # =============== FAULT SIMULATION ====================
     # =====================================================
     def SetPartition(self, request, context):
         with self.lock:
-            self.blocked_peers = set(request.blocked_addresses)
-            print(f"[{self.node_id}] Partition set. Blocking: {self.blocked_peers}")
+            self.blocked_peers = frozenset(request.blocked_addresses)
+            self._active_peers = tuple(
+                (peer_id, addr) for peer_id, addr in self._peer_list
+                if addr not in self.blocked_peers
+            )
+            logger.info("[%s] Partition set. Blocking: %s", self.node_id, self.blocked_peers)
         return raft_pb2.PartitionResponse(success=True)
 
     # =====================================================
@@ -73,67 +166,107 @@ class RaftNode(raft_pb2_grpc.RaftServicer):
         Theo dõi timeout, nếu follower quá lâu không nhận heartbeat
         thì trở thành candidate và bắt đầu bầu leader
         """
+        # Chờ khởi động ổn định
+        time.sleep(max(0, 10 - (time.monotonic() - self.start_time)))
+
         while True:
-            time.sleep(0.1)
+            # Không poll: ngủ tới khi có heartbeat (reset timer) hoặc hết timeout
+            timeout = self.election_timeout()
+            self.hb_event.clear()
+            if self.hb_event.wait(timeout=timeout):
+                continue
 
-            if time.time() - self.start_time < 10:
-                continue # Chờ khởi động ổn định
             with self.lock:
                 if self.state == LEADER:
                     continue
 
-                timeout = random.uniform(5, 10)
-                if time.time() - self.last_heartbeat < timeout:
-                    continue
-
                 # Timeout → start election
-                print(f"[{self.node_id}] Election timeout after {timeout:.2f}s, starting election")
+                logger.info("[%s] Election timeout after %.2fs, starting election", self.node_id, timeout)
                 self.state = CANDIDATE
                 self.current_term += 1
                 self.voted_for = self.node_id
+                election_term = self.current_term
                 votes = 1
+                stepped_down = False
 
-                print(f"[{self.node_id}] Start election (term {self.current_term})")
+                logger.info("[%s] Start election (term %d)", self.node_id, self.current_term)
 
-            # Gửi RequestVote tới các peer
-            for peer_id, addr in self.peers.items():
-                if addr in self.blocked_peers:
-                    continue
-                try:
-                    channel = grpc.insecure_channel(addr)
-                    stub = raft_pb2_grpc.RaftStub(channel)
-
-                    last_index = len(self.log) - 1
-                    last_term = self.log[last_index].term if last_index >= 0 else 0
-
-                    resp = stub.RequestVote(
-                        raft_pb2.RequestVoteRequest(
-                            term=self.current_term,
-                            candidate_id=self.node_id,
-                            last_log_index=last_index,
-                            last_log_term=last_term,
-                        ),
-                        timeout=1,
-                    )
+                # Request giống nhau cho mọi peer → tạo 1 lần cho cả vòng bầu cử
+                last_index = len(self.log) - 1
+                last_term = self.log[last_index].term if last_index >= 0 else 0
+                vote_req = raft_pb2.RequestVoteRequest(
+                    term=self.current_term,
+                    candidate_id=self.node_id,
+                    last_log_index=last_index,
+                    last_log_term=last_term,
+                )
+
+            # Gửi RequestVote tới mọi peer cùng lúc, xử lý theo thứ tự trả lời về;
+            # cả vòng bị chặn bởi 1 deadline thay vì cộng dồn timeout từng peer
+            deadline = time.monotonic() + RPC_ROUND_TIMEOUT
+            done = queue.Queue()
+            pending = {}
+            for peer_id, addr in self._active_peers:
+                future = self.pools[peer_id].next_stub().RequestVote.future(
+                    vote_req, timeout=RPC_ROUND_TIMEOUT
+                )
+                pending[future] = peer_id
+                future.add_done_callback(done.put)
+
+            try:
+                for _ in range(len(pending)):
+                    # Đủ phiếu → khỏi chờ các peer còn lại
+                    if votes > self.majority:
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        future = done.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    peer_id = pending[future]
+                    try:
+                        resp = future.result()
+                    except grpc.RpcError:
+                        continue
 
                     with self.lock:
                         # If peer reports a higher term, step down
                         if resp.term > self.current_term:
-                            print(f"[{self.node_id}] Seen higher term {resp.term} from {peer_id}, stepping down")
+                            logger.info("[%s] Seen higher term %d from %s, stepping down", self.node_id, resp.term, peer_id)
                             self.current_term = resp.term
                             self.state = FOLLOWER
                             self.voted_for = None
-                        elif resp.vote_granted:
+                        # Đã về follower (kể cả do nhận AppendEntries) → phiếu còn lại vô nghĩa
+                        if self.state != CANDIDATE or self.current_term != election_term:
+                            stepped_down = True
+                            break
+                        if resp.vote_granted:
                             votes += 1
-
-                except:
-                    pass
+            finally:
+                for future in pending:
+                    future.cancel()
 
             with self.lock:
-                if votes > (len(self.peers) + 1) // 2:
+                if stepped_down or self.state != CANDIDATE or self.current_term != election_term:
+                    continue
+                if votes > self.majority:
                     self.become_leader()
                 else:
-                    print(f"[{self.node_id}] Election failed: got {votes} votes, need >{(len(self.peers) + 1) // 2}")
+                    logger.info("[%s] Election failed: got %d votes, need >%d", self.node_id, votes, self.majority)
+
+    def election_timeout(self):
+        """
+        Election timeout ngẫu nhiên, thích nghi theo nhịp heartbeat đo được
+        """
+        samples = list(self.hb_intervals)
+        if len(samples) < MIN_HB_SAMPLES:
+            e_t = ELECTION_TIMEOUT_MAX
+        else:
+            e_t = statistics.fmean(samples) + 3 * statistics.pstdev(samples)
+            e_t = min(max(e_t, ELECTION_TIMEOUT_MIN), ELECTION_TIMEOUT_MAX)
+        return random.uniform(e_t, 2 * e_t)
 
     def become_leader(self):
         """
@@ -146,8 +279,10 @@ class RaftNode(raft_pb2_grpc.RaftServicer):
         for peer_id in self.peers:
             self.next_index[peer_id] = len(self.log)
             self.match_index[peer_id] = -1
+        self._peer_fails.clear()
+        self._peer_fail_until.clear()
 
-        print(f"[{self.node_id}] Become LEADER (term {self.current_term})")
+        logger.info("[%s] Become LEADER (term %d)", self.node_id, self.current_term)
 
         threading.Thread(target=self.heartbeat_loop, daemon=True).start()
 
@@ -155,80 +290,167 @@ class RaftNode(raft_pb2_grpc.RaftServicer):
         """
         Leader gửi heartbeat và replicate log
         """
-        while self.state == LEADER:
+        term = self.current_term
+        while self.state == LEADER and self.current_term == term:
             self.heartbeat_count += 1
-            print(f"[{self.node_id}] HEARTBEAT #{self.heartbeat_count}")
+            logger.debug("[%s] HEARTBEAT #%d", self.node_id, self.heartbeat_count)
 
-            for peer_id, addr in self.peers.items():
-                if addr in self.blocked_peers:
-                    continue
-                self.send_append_entries(peer_id, addr)
+            # Gửi không chờ reply → 1 follower chậm không làm trễ các follower khác
+            self.send_append_entries()
 
-            time.sleep(1)
+            # Chờ tới heartbeat kế tiếp, hoặc dậy sớm khi có ClientSet mới;
+            # khi đó chờ thêm batch_window để gom các SET tới gần nhau vào 1 lô
+            with self.pending_cv:
+                self.pending_cv.wait_for(
+                    lambda: self.pending_entries > 0 or self.state != LEADER,
+                    timeout=HEARTBEAT_INTERVAL,
+                )
+                if 0 < self.pending_entries < self.batch_max:
+                    self.pending_cv.wait_for(
+                        lambda: self.pending_entries >= self.batch_max,
+                        timeout=self.batch_window,
+                    )
+                self.pending_entries = 0
 
     # =====================================================
     # ================== APPEND ENTRIES ===================
     # =====================================================
 
-    def send_append_entries(self, peer_id, addr):
+    def send_append_entries(self, timeout=RPC_ROUND_TIMEOUT):
         """
-        Leader gửi AppendEntries cho follower
+        Leader gửi AppendEntries cho các follower (không chặn chờ reply,
+        reply được xử lý trong _on_append_reply).
+        Follower có cùng next_index nhận chung 1 request → mỗi lượt chỉ
+        tạo 1 request cho mỗi giá trị next_index khác nhau.
         """
-        try:
-            channel = grpc.insecure_channel(addr)
-            stub = raft_pb2_grpc.RaftStub(channel)
-
-            next_idx = self.next_index[peer_id]
-            prev_idx = next_idx - 1
-            prev_term = self.log[prev_idx].term if prev_idx >= 0 else 0
-            entries = self.log[next_idx:]
-
-            resp = stub.AppendEntries(
-                raft_pb2.AppendEntriesRequest(
-                    term=self.current_term,
-                    leader_id=self.node_id,
-                    prev_log_index=prev_idx,
-                    prev_log_term=prev_term,
-                    entries=entries,
-                    leader_commit=self.commit_index,
-                ),
-                timeout=1,
+        with self.lock:
+            if self.state != LEADER:
+                return
+            term = self.current_term
+            requests = {}  # next_idx -> (request, số entry)
+            cache = {}
+            targets = []   # (peer_id, next_idx)
+            now = time.monotonic()
+            for peer_id, addr in self._active_peers:
+                if now < self._peer_fail_until.get(peer_id, 0):
+                    continue  # peer đang backoff
+                next_idx = self.next_index[peer_id]
+                if next_idx not in requests:
+                    prev_idx = next_idx - 1
+                    prev_term = self.log[prev_idx].term if prev_idx >= 0 else 0
+                    # Log của leader chỉ được nối thêm → (term, len(log)) xác định
+                    # đúng đoạn entries, khỏi phải cắt slice để so sánh
+                    key = (term, self.commit_index, len(self.log), prev_term)
+                    cached = self._req_cache.get(next_idx)
+                    if cached and cached[0] == key:
+                        request, n_entries = cached[1], cached[2]
+                    else:
+                        entries = self.log[next_idx:next_idx + MAX_APPEND_ENTRIES]
+                        request = raft_pb2.AppendEntriesRequest(
+                            term=term,
+                            leader_id=self.node_id,
+                            prev_log_index=prev_idx,
+                            prev_log_term=prev_term,
+                            entries=entries,
+                            leader_commit=self.commit_index,
+                        )
+                        n_entries = len(entries)
+                    cache[next_idx] = (key, request, n_entries)
+                    requests[next_idx] = (request, n_entries)
+                targets.append((peer_id, next_idx))
+            self._req_cache = cache
+
+        for peer_id, next_idx in targets:
+            request, n_entries = requests[next_idx]
+            future = self.pools[peer_id].next_stub().AppendEntries.future(
+                request, timeout=timeout
+            )
+            future.add_done_callback(
+                lambda f, peer_id=peer_id, prev_idx=next_idx - 1, n=n_entries:
+                    self._on_append_reply(f, peer_id, term, prev_idx, n)
             )
 
-            with self.lock:
-                if resp.success:
-                    self.match_index[peer_id] = prev_idx + len(entries)
-                    self.next_index[peer_id] = self.match_index[peer_id] + 1
-                    self.update_commit_index()
-                else:
-                    self.next_index[peer_id] = max(0, self.next_index[peer_id] - 1)
+    def _on_append_reply(self, future, peer_id, term, prev_idx, n_entries):
+        """
+        Xử lý reply AppendEntries. Reply có thể về không theo thứ tự
+        nên match_index chỉ được tăng (max-guard).
+        """
+        try:
+            resp = future.result()
+        except grpc.RpcError as e:
+            if e.code() == grpc.StatusCode.UNAVAILABLE:
+                with self.lock:
+                    now = time.monotonic()
+                    # Nhiều RPC pipeline cùng lỗi một lúc chỉ tính là 1 lần:
+                    # bỏ qua reply không ứng với next_index hiện tại, hoặc khi
+                    # peer đang trong backoff
+                    if (self.next_index.get(peer_id) != prev_idx + 1
+                            or now < self._peer_fail_until.get(peer_id, 0)):
+                        return
+                    fails = self._peer_fails.get(peer_id, 0) + 1
+                    self._peer_fails[peer_id] = fails
+                    self._peer_fail_until[peer_id] = now + min(
+                        PEER_BACKOFF_MAX, PEER_BACKOFF_BASE * 2 ** (fails - 1)
+                    )
+            return
 
-        except:
-            pass
+        with self.lock:
+            self._peer_fails.pop(peer_id, None)
+            self._peer_fail_until.pop(peer_id, None)
+            if self.state != LEADER or self.current_term != term:
+                return  # reply của term cũ
+
+            if resp.term > self.current_term:
+                logger.info("[%s] Seen higher term %d from %s, stepping down", self.node_id, resp.term, peer_id)
+                self.current_term = resp.term
+                self.state = FOLLOWER
+                self.voted_for = None
+                return
+
+            if resp.success:
+                matched = prev_idx + n_entries
+                # next_index luôn tiến: follower restart (log rỗng) có
+                # match_index cũ cao hơn matched nhưng vẫn phải được gửi tiếp
+                self.next_index[peer_id] = max(self.next_index[peer_id], matched + 1)
+                if matched <= self.match_index[peer_id]:
+                    return  # heartbeat / reply trễ: không có gì mới để commit
+                self.match_index[peer_id] = matched
+                self.update_commit_index()
+            elif self.next_index[peer_id] == prev_idx + 1:
+                # Chỉ lùi 1 lần cho mỗi lần thử next_index hiện tại
+                self.next_index[peer_id] = max(0, prev_idx)
 
     def AppendEntries(self, request, context):
         """
         Follower nhận heartbeat hoặc log từ leader
         """
-        with self.lock:
-            # Check partition
-            if request.leader_id in self.peers:
-                addr = self.peers[request.leader_id]
-                if addr in self.blocked_peers:
-                    return raft_pb2.AppendEntriesResponse(
-                        term=self.current_term, success=False
-                    )
+        # Check partition (peers không đổi, blocked_peers chỉ bị gán lại
+        # nguyên khối trong SetPartition → đọc được không cần lock)
+        addr = self.peers.get(request.leader_id)
+        if addr is not None and addr in self.blocked_peers:
+            return raft_pb2.AppendEntriesResponse(
+                term=self.current_term, success=False
+            )
 
+        # Term + kiểm tra/ghi log phải nằm trong cùng 1 critical section:
+        # tách ra thì entry của leader cũ có thể lọt vào sau khi đã đổi term
+        with self.lock:
             if request.term < self.current_term:
                 return raft_pb2.AppendEntriesResponse(
                     term=self.current_term, success=False
                 )
 
             # Update leader info
+            now = time.monotonic()
+            if self.leader_id == request.leader_id and self.current_term == request.term:
+                self.hb_intervals.append(now - self.last_heartbeat)
+            else:
+                self.hb_intervals.clear()  # leader mới → đo lại từ đầu
             self.state = FOLLOWER
             self.leader_id = request.leader_id
             self.current_term = request.term
-            self.last_heartbeat = time.time()
+            self.last_heartbeat = now
+            self.hb_event.set()
 
             # 1. Check prev_log_index & prev_log_term
             if request.prev_log_index >= 0:
@@ -243,22 +465,27 @@ class RaftNode(raft_pb2_grpc.RaftServicer):
                     )
 
             # 2. Append / overwrite log
-            idx = request.prev_log_index + 1
-            for entry in request.entries:
-                if idx < len(self.log):
-                    if self.log[idx].term != entry.term:
-                        self.log = self.log[:idx]
-                        self.log.append(entry)
-                else:
-                    self.log.append(entry)
-                idx += 1
-
-            # 3. Update commit index
-            if request.leader_commit > self.commit_index:
-                self.commit_index = min(
-                    request.leader_commit, len(self.log) - 1
-                )
-                self.apply_committed_logs()
+            # Bỏ qua phần entry đã khớp, rồi 1 lần gán slice vừa cắt đoạn
+            # xung đột vừa nối phần còn lại. Nếu mọi entry đều khớp thì giữ
+            # nguyên log (request đến trễ không được cắt mất entry mới hơn)
+            base = request.prev_log_index + 1
+            entries = request.entries
+            k = 0
+            end = min(len(entries), len(self.log) - base)
+            while k < end and self.log[base + k].term == entries[k].term:
+                k += 1
+            if k < len(entries):
+                self.log[base + k:] = entries[k:]
+
+            # 3. Update commit index (applier thread sẽ apply)
+            # Chỉ tính tới entry cuối của request này: request bị giới hạn
+            # MAX_APPEND_ENTRIES nên phần log phía sau chưa được leader
+            # xác nhận, có thể là đuôi cũ chưa cắt
+            last_new = request.prev_log_index + len(request.entries)
+            new_commit = min(request.leader_commit, last_new)
+            if new_commit > self.commit_index:
+                self.commit_index = new_commit
+                self.apply_cv.notify()
 
             return raft_pb2.AppendEntriesResponse(
                 term=self.current_term, success=True
@@ -282,13 +509,13 @@ class RaftNode(raft_pb2_grpc.RaftServicer):
                     )
             # If the request has a higher term, update our term and reset previous vote
             if request.term > self.current_term:
-                print(f"[{self.node_id}] RequestVote with higher term {request.term} (was {self.current_term}); updating term and clearing vote")
+                logger.info("[%s] RequestVote with higher term %d (was %d); updating term and clearing vote", self.node_id, request.term, self.current_term)
                 self.current_term = request.term
                 self.voted_for = None
                 self.state = FOLLOWER
 
             if request.term < self.current_term:
-                print(f"[{self.node_id}] Deny vote to {request.candidate_id}: term {request.term} < {self.current_term}")
+                logger.info("[%s] Deny vote to %s: term %d < %d", self.node_id, request.candidate_id, request.term, self.current_term)
                 return raft_pb2.RequestVoteResponse(
                     term=self.current_term, vote_granted=False
                 )
@@ -299,12 +526,13 @@ class RaftNode(raft_pb2_grpc.RaftServicer):
             ):
                 self.voted_for = request.candidate_id
                 # current_term already updated above when necessary
-                print(f"[{self.node_id}] Grant vote to {request.candidate_id} (term {request.term})")
+                logger.info("[%s] Grant vote to %s (term %d)", self.node_id, request.candidate_id, request.term)
+                self.hb_event.set()  # đã cấp phiếu → không tự ứng cử ngay
                 return raft_pb2.RequestVoteResponse(
                     term=self.current_term, vote_granted=True
                 )
 
-            print(f"[{self.node_id}] Deny vote to {request.candidate_id}: already voted for {self.voted_for}")
+            logger.info("[%s] Deny vote to %s: already voted for %s", self.node_id, request.candidate_id, self.voted_for)
             return raft_pb2.RequestVoteResponse(
                 term=self.current_term, vote_granted=False
             )
@@ -315,33 +543,55 @@ class RaftNode(raft_pb2_grpc.RaftServicer):
 
     def update_commit_index(self):
         """
-        Leader commit log khi được replicate trên majority
+        Leader commit log khi được replicate trên majority.
+        Gọi khi đang giữ self.lock
         """
-        for i in range(len(self.log) - 1, self.commit_index, -1):
-            count = 1  # leader itself
-            for peer in self.match_index:
-                if self.match_index[peer] >= i:
-                    count += 1
-
-            if (
-                count > (len(self.peers) + 1) // 2
-                and self.log[i].term == self.current_term
-            ):
-                self.commit_index = i
-                self.apply_committed_logs()
-                break
-
-    def apply_committed_logs(self):
+        # Index lớn nhất đã có trên > majority node (tính cả leader):
+        # sắp xếp giảm dần, phần tử thứ `majority` (0-based)
+        replicated = list(self.match_index.values())
+        replicated.append(len(self.log) - 1)  # leader luôn có cả log
+        replicated.sort(reverse=True)
+        n = replicated[self.majority]
+
+        # Chỉ commit trực tiếp entry của term hiện tại. Term trong log
+        # không giảm, nên nếu log[n] thuộc term cũ thì mọi index < n cũng vậy
+        if n > self.commit_index and self.log[n].term == self.current_term:
+            self.commit_index = n
+            self.apply_cv.notify()
+
+    def apply_loop(self):
         """
-        Apply log đã commit vào key-value store
+        Applier thread: chờ commit_index tăng, lấy đoạn log mới commit
+        trong lock rồi apply vào key-value store ngoài lock.
+        kv_store chỉ được ghi ở thread này.
         """
-        while self.last_applied < self.commit_index:
-            self.last_applied += 1
-            entry = self.log[self.last_applied]
-            self.kv_store[entry.key] = entry.value
-            print(
-                f"[{self.node_id}] COMMIT {entry.key}={entry.value}"
-            )
+        while True:
+            with self.apply_cv:
+                self.apply_cv.wait_for(
+                    lambda: self.last_applied < self.commit_index
+                )
+                # Entry đã commit không bị ghi đè → an toàn dùng ngoài lock
+                first = self.last_applied + 1
+                entries = self.log[first:self.commit_index + 1]
+                self.last_applied = self.commit_index
+
+            for entry in entries:
+                self.kv_store[entry.key] = entry.value
+            # 1 dòng log cho cả lô, chi tiết từng entry chỉ ở mức debug
+            if len(entries) == 1:
+                logger.info(
+                    "[%s] COMMIT %s=%s", self.node_id, entries[0].key, entries[0].value
+                )
+            else:
+                logger.info(
+                    "[%s] COMMIT %d entries (index %d..%d)",
+                    self.node_id, len(entries), first, first + len(entries) - 1,
+                )
+                if logger.isEnabledFor(logging.DEBUG):
+                    for entry in entries:
+                        logger.debug(
+                            "[%s] COMMIT %s=%s", self.node_id, entry.key, entry.value
+                        )
 
     # =====================================================
     # ===================== CLIENT API ====================
@@ -367,9 +617,12 @@ class RaftNode(raft_pb2_grpc.RaftServicer):
                 value=request.value,
             )
             self.log.append(entry)
+            self.pending_entries += 1
+            self.pending_cv.notify()
 
-            print(
-                f"[{self.node_id}] RECEIVE CLIENT SET {request.key}={request.value}"
+            logger.info(
+                "[%s] RECEIVE CLIENT SET %s=%s",
+                self.node_id, request.key, request.value,
             )
 
             return raft_pb2.ClientSetResponse(success=True)
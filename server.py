@@ -4,24 +4,86 @@ File này chỉ có nhiệm vụ:
 - Gắn RaftNode vào server
 """
 
+import atexit
+import sys
 import grpc
 import argparse
+import logging
+import logging.handlers
+import queue
 from concurrent import futures
 
 import raft_pb2_grpc
 from raft_node import RaftNode
 
-def serve(node_id, port, peers):
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+# Cho phép client giữ kết nối bằng keepalive ping khi không có RPC nào
+SERVER_OPTIONS = [
+    ("grpc.keepalive_permit_without_calls", 1),
+    ("grpc.http2.min_ping_interval_without_data_ms", 10000),
+    ("grpc.max_concurrent_streams", 1000),
+]
+
+def worker_count(peers):
+    """
+    Mỗi peer có thể giữ vài RPC cùng lúc (AppendEntries pipeline, RequestVote),
+    cộng thêm chỗ cho client → heartbeat không phải xếp hàng sau ClientSet
+    """
+    return 4 * len(peers) + 32
+
+def parse_batch_append(value):
+    """
+    "K,T" → (K entry, T ms đổi ra giây); sai định dạng → lỗi usage của argparse
+    """
+    try:
+        batch_max, batch_ms = value.split(",")
+        batch_max, batch_ms = int(batch_max), float(batch_ms)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"phải có dạng K,T (VD: 64,5), nhận được {value!r}"
+        )
+    if batch_max < 1 or batch_ms < 0:
+        raise argparse.ArgumentTypeError(
+            f"cần K >= 1 và T >= 0, nhận được {value!r}"
+        )
+    return batch_max, batch_ms / 1000
+
+def setup_logging(level=logging.INFO):
+    """
+    Log của RaftNode đi qua QueueHandler → QueueListener:
+    thread gọi logger chỉ đẩy record vào queue, việc ghi stdout do
+    listener thread làm, không giữ self.lock trong lúc chờ I/O
+    """
+    log_queue = queue.Queue(-1)
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    atexit.register(listener.stop)  # ghi nốt log còn trong queue khi thoát
+
+    logger = logging.getLogger("raft")
+    logger.setLevel(level)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.propagate = False
+    return listener
+
+def serve(node_id, port, peers, batch_max, batch_window):
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=worker_count(peers)),
+        options=SERVER_OPTIONS,
+    )
+    node = RaftNode(node_id, peers, batch_max=batch_max, batch_window=batch_window)
     raft_pb2_grpc.add_RaftServicer_to_server(
-        RaftNode(node_id, peers),
+        node,
         server
     )
 
     server.add_insecure_port(f"[::]:{port}")
     server.start()
     print(f"{node_id} running on port {port}")
-    server.wait_for_termination()
+    try:
+        server.wait_for_termination()
+    finally:
+        node.close()
 
 
 if __name__ == "__main__":
@@ -29,12 +91,26 @@ if __name__ == "__main__":
     parser.add_argument("--id", required=True)
     parser.add_argument("--port", required=True)
     parser.add_argument("--peers", nargs="*", default=[])
+    parser.add_argument(
+        "--batch-append",
+        type=parse_batch_append,
+        default="64,5",
+        help="K,T: replicate ngay khi có K entry mới hoặc sau T ms (mặc định 64,5)",
+    )
+
+    parser.add_argument(
+        "--debug",
+        action="store_true",
+        help="In cả log chi tiết (HEARTBEAT, từng entry được COMMIT)",
+    )
 
     args = parser.parse_args()
+    setup_logging(logging.DEBUG if args.debug else logging.INFO)
 
     peers = {
         f"node{i+1}": addr
         for i, addr in enumerate(args.peers)
     }
 
-    serve(args.id, args.port, peers)
+    batch_max, batch_window = args.batch_append
+    serve(args.id, args.port, peers, batch_max, batch_window)